@@ -5,10 +5,15 @@ import json
 BASE_DIR = Path(__file__).parent
 MAPS_DIR = BASE_DIR / "maps"
 TILES_DIR = BASE_DIR / "tiles"
+OVERLAY_DIR = BASE_DIR / "overlays"
+OVERLAY_FILE = OVERLAY_DIR / "routes.mbtiles"
+EXPORT_DIR = BASE_DIR / "exports"
 SETTINGS_FILE = BASE_DIR / "settings.json"
 
 MAPS_DIR.mkdir(exist_ok=True)
 TILES_DIR.mkdir(exist_ok=True)
+OVERLAY_DIR.mkdir(exist_ok=True)
+EXPORT_DIR.mkdir(exist_ok=True)
 
 DEFAULT_TILES = next(TILES_DIR.glob("*.mbtiles"), None)
 
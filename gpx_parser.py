@@ -1,4 +1,10 @@
 # gpx_parser.py
+import bz2
+import gzip
+import lzma
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
 import gpxpy
 from datetime import datetime
 from utils import haversine
@@ -8,6 +14,13 @@ import pytz
 EAT = pytz.timezone('Africa/Nairobi')
 UTC = pytz.UTC  # Keep reference
 
+# Inputs: plain .gpx, compressed .gpx.gz/.bz2/.xz/.zst, and .zip bundles.
+# Archive members are addressed as 'bundle.zip::member.gpx'.
+GPX_SUFFIX = '.gpx'
+COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.xz', '.zst')
+ARCHIVE_SUFFIX = '.zip'
+ARCHIVE_SEP = '::'
+
 
 def to_eat(gpx_time):
     """
@@ -45,8 +58,86 @@ def to_eat(gpx_time):
     return gpx_time.astimezone(EAT)
 
 
+def is_gpx_name(name: str) -> bool:
+    """True for 'x.gpx' and compressed variants like 'x.gpx.gz'"""
+    name = name.lower()
+    for suffix in COMPRESSED_SUFFIXES:
+        name = name.removesuffix(suffix)
+    return name.endswith(GPX_SUFFIX)
+
+
+def list_gpx_sources(folder):
+    """
+    All GPX inputs in folder (non-recursive):
+    - plain and compressed files → their Path
+    - GPX members of .zip bundles → Path('bundle.zip::member.gpx')
+    """
+    sources = []
+    for f in Path(folder).iterdir():
+        if not f.is_file():
+            continue
+        if is_gpx_name(f.name):
+            sources.append(f)
+        elif f.suffix.lower() == ARCHIVE_SUFFIX:
+            try:
+                with zipfile.ZipFile(f) as zf:
+                    members = [i.filename for i in zf.infolist() if not i.is_dir()]
+            except Exception as e:
+                print(f"[WARN] Skipping bad archive {f.name}: {e}")
+                continue
+            sources.extend(Path(f"{f}{ARCHIVE_SEP}{m}")
+                           for m in members if is_gpx_name(m))
+    return sources
+
+
+def source_name(path) -> str:
+    """Base file name of a source, looking inside archives"""
+    name = str(path).rsplit(ARCHIVE_SEP, 1)[-1]
+    return name.replace('\\', '/').rsplit('/', 1)[-1]
+
+
+def _decompress(raw, name: str):
+    """Wrap a binary stream in a streaming decompressor based on suffix"""
+    name = name.lower()
+    if name.endswith('.gz'):
+        return gzip.GzipFile(fileobj=raw)
+    if name.endswith('.bz2'):
+        return bz2.BZ2File(raw)
+    if name.endswith('.xz'):
+        return lzma.LZMAFile(raw)
+    if name.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstandard is required for .zst files (pip install zstandard)")
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    return raw
+
+
+@contextmanager
+def open_gpx_stream(path):
+    """
+    Open any GPX source as a binary stream for the parser.
+    Compressed files and archive members are decompressed straight from
+    the source, without temp files (gpxpy still reads the whole document).
+    """
+    path = str(path)
+    if ARCHIVE_SEP in path:
+        archive, member = path.rsplit(ARCHIVE_SEP, 1)
+        member = member.replace('\\', '/')  # Zip names always use '/'; Windows paths flip them
+        with zipfile.ZipFile(archive) as zf, zf.open(member) as raw:
+            with _decompress(raw, member) as stream:
+                yield stream
+        return
+
+    with open(path, 'rb') as raw:
+        with _decompress(raw, path) as stream:
+            yield stream
+
+
 def safe_date_from_filename(name: str) -> str | None:
     try:
+        name = source_name(name)
         d = name.split('_', 1)[0]
         datetime.strptime(d, '%Y-%m-%d')
         return d
@@ -57,7 +148,7 @@ def safe_date_from_filename(name: str) -> str | None:
 def enrich_track(track):
     points = []
     prev = None
-    for seg in track.segments:
+    for seg_idx, seg in enumerate(track.segments):
         for p in seg.points:
             cur = (p.latitude, p.longitude)
             speed = None
@@ -80,15 +171,29 @@ def enrich_track(track):
                 "calc_time": calc_time,    # ← raw for math
                 "elev": p.elevation,
                 "speed": speed,
-                "duration": duration
+                "duration": duration,
+                "segment": seg_idx
             })
             prev = points[-1]
     return points
 
 
+def waypoint_times(waypoints):
+    """(EAT time, waypoint) pairs, converted once and sorted by time; untimed last"""
+    timed = [(to_eat(wp.time), wp) for wp in waypoints]
+    return sorted(timed, key=lambda x: (x[0] is None, x[0] or 0))
+
+
+def stop_seconds(times):
+    """Waypoints = stops: sum the gaps between consecutive sorted times longer than 1 min"""
+    times = [t for t in times if t]
+    gaps = ((b - a).total_seconds() for a, b in zip(times, times[1:]))
+    return sum(d for d in gaps if d > 60)  # Only count stops > 1 min
+
+
 def parse_gpx_file(path):
     try:
-        with open(path, 'r', encoding='utf-8') as f:
+        with open_gpx_stream(path) as f:
             return gpxpy.parse(f)
     except Exception as e:
-        raise ValueError(f"Failed to parse {path.name}: {e}")
\ No newline at end of file
+        raise ValueError(f"Failed to parse {source_name(path)}: {e}")
@@ -3,8 +3,10 @@ from tkinter import ttk, filedialog, messagebox
 from pathlib import Path
 import darkdetect
 from config import load_settings, save_settings, MAPS_DIR, TILES_DIR
-from gpx_parser import parse_gpx_file, safe_date_from_filename
+from gpx_parser import parse_gpx_file, safe_date_from_filename, list_gpx_sources
 from map_generator import create_map
+from route_overlay import build_overlay
+from history_server import serve_history
 import webbrowser
 
 class GPXMapperGUI:
@@ -59,6 +61,7 @@ class GPXMapperGUI:
         f3 = ttk.Frame(self.root)
         f3.pack(fill='x', **pad)
         ttk.Button(f3, text="Refresh Files", command=self.load_files).pack(side='left', padx=5)
+        ttk.Button(f3, text="Update History", command=self.update_history).pack(side='left', padx=5)
         ttk.Button(f3, text="Generate Selected", command=self.generate).pack(side='right', padx=5)
 
         # Status
@@ -136,16 +139,41 @@ class GPXMapperGUI:
         save_settings(self.settings)
 
         self.listbox.delete(0, tk.END)
-        files = [f for f in folder.iterdir() if f.suffix.lower() == '.gpx']
+        files = list_gpx_sources(folder)
         dated = []
         for f in files:
             if d := safe_date_from_filename(f.name):
                 dated.append((d, f))
         dated.sort(key=lambda x:x[0], reverse=True)
         for d, f in dated:
-            self.listbox.insert(tk.END, f"{d} → {f.name}")
+            self.listbox.insert(tk.END, f"{d} → {f.relative_to(folder)}")
         self.status.config(text=f"{len(dated)} files", fg="green")
 
+    def update_history(self):
+        folder = Path(self.folder_var.get())
+        if not folder.is_dir():
+            self.status.config(text="Invalid folder", fg="red")
+            return
+
+        self.status.config(text="Rendering history overlay...", fg="blue")
+        self.root.update()
+        try:
+            added, written = build_overlay(list_gpx_sources(folder))
+        except Exception as e:
+            messagebox.showerror("Overlay Error", str(e))
+            self.status.config(text="Overlay failed", fg="red")
+            return
+        self.status.config(text=f"History: +{added} routes, {written} tiles updated", fg="green")
+
+        # One local viewer per session; it reads the overlay live
+        if not getattr(self, "history_url", None):
+            try:
+                self.history_server, self.history_url = serve_history(map_dark_mode=self.dark_mode)
+            except Exception as e:
+                messagebox.showerror("Viewer Error", str(e))
+                return
+        webbrowser.open(self.history_url)
+
     def generate(self):
         sel = self.listbox.curselection()
         if not sel:
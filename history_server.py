@@ -0,0 +1,73 @@
+# history_server.py
+"""
+Local viewer for the route history overlay (config.OVERLAY_FILE).
+
+Leaflet can't read MBTiles directly, so this serves:
+    /                        history map page
+    /overlay/{z}/{x}/{y}.png overlay tiles, read with mbtiles.read_tile
+"""
+import re
+import sys
+import threading
+import webbrowser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config import OVERLAY_FILE
+from map_generator import create_history_map
+from mbtiles import open_readonly, get_metadata, read_tile
+
+TILE_PATH = re.compile(r'^/overlay/(\d+)/(\d+)/(\d+)\.png$')
+
+
+def make_handler(path, map_dark_mode):
+    local = threading.local()
+
+    def connection():
+        if getattr(local, "conn", None) is None:
+            local.conn = open_readonly(path)
+        return local.conn
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send(self, status, body=b"", content_type="text/plain"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path in ("/", "/index.html"):
+                m = create_history_map("/overlay/{z}/{x}/{y}.png", get_metadata(connection()), map_dark_mode)
+                return self.send(200, m.get_root().render().encode("utf-8"), "text/html; charset=utf-8")
+            match = TILE_PATH.match(self.path)
+            if not match:
+                return self.send(404)
+            data = read_tile(connection(), *map(int, match.groups()))
+            if data is None:
+                return self.send(404)
+            self.send(200, data, "image/png")
+
+    return Handler
+
+
+def serve_history(path=OVERLAY_FILE, map_dark_mode=False, port=0):
+    """Start the viewer in a background thread. Returns (server, url)."""
+    if not path.exists():
+        raise ValueError(f"No overlay yet: {path.name} (run Update History first)")
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(path, map_dark_mode))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+if __name__ == '__main__':
+    # python history_server.py [port]
+    server, url = serve_history(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+    print(f"Route history at {url} (Ctrl+C to stop)")
+    webbrowser.open(url)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
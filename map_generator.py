@@ -1,17 +1,130 @@
 # map_generator.py
+import json
 import folium
-from folium.plugins import AntPath, MiniMap
+import numpy as np
+from folium.plugins import AntPath, MiniMap, FastMarkerCluster
 from tkinter import messagebox
 from config import MAPS_DIR
-from utils import speed_to_color, haversine
-from gpx_parser import enrich_track, to_eat
+from utils import speed_to_color, haversine, lttb
+from gpx_parser import enrich_track, stop_seconds, waypoint_times
+
+PROFILE_POINTS = 1000  # Max points per chart series, whatever the track length
+
+# row = [lat, lon, name, time]; popup HTML is only built when a stop is opened
+WAYPOINT_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker([row[0], row[1]], {radius: 7, color: 'purple', fill: true});
+    marker.bindPopup(function () {
+        var name = document.createElement('b');
+        name.textContent = row[2];
+        return name.outerHTML + '<br>Time: ' + row[3];
+    }, {maxWidth: 250});
+    return marker;
+}"""
+
+
+def build_profile(samples, n_out=PROFILE_POINTS):
+    """
+    samples: (epoch_seconds, elev_m, speed_mps, lat, lon) per timed point
+    Returns {"elev": {...}, "speed": {...}} series downsampled with LTTB,
+    each with times, values and the matching route positions.
+    """
+    if not samples:
+        return {}
+    data = np.array(samples, dtype=float)  # None → nan
+    data = data[np.argsort(data[:, 0], kind="stable")]  # Tracks may be out of order
+    profile = {}
+    for name, col, scale in (("elev", 1, 1.0), ("speed", 2, 3.6)):
+        rows = data[np.isfinite(data[:, col])]
+        if len(rows) < 2:
+            continue
+        rows = rows[lttb(rows[:, 0], rows[:, col], n_out)]
+        profile[name] = {
+            "t": rows[:, 0].round().astype(int).tolist(),
+            "v": (rows[:, col] * scale).round(1).tolist(),
+            "ll": rows[:, 3:5].round(6).tolist(),
+        }
+    return profile
+
+
+def profile_chart_html(map_name, profile):
+    """Elevation/speed chart panel (top-right, clear of the MiniMap); hovering moves a marker along the route"""
+    return f'''
+    <div id="profile-panel" style="position:fixed;top:10px;right:10px;z-index:1000;background:rgba(0,0,0,0.75);color:white;padding:8px;border-radius:8px;font-family:Arial;font-size:12px;">
+        <b>Profile</b> &nbsp; <span style="color:#4fc3f7;">Elevation (m)</span> &nbsp; <span style="color:#ff8800;">Speed (km/h)</span>
+        <span id="profile-readout" style="float:right;margin-left:10px;"></span><br>
+        <canvas id="profile-chart" width="420" height="140" style="cursor:crosshair;"></canvas>
+    </div>
+    <script>
+    window.addEventListener('load', function() {{
+        var data = {json.dumps(profile)};
+        var map = {map_name};
+        var canvas = document.getElementById('profile-chart');
+        var ctx = canvas.getContext('2d');
+        var W = canvas.width, H = canvas.height, PAD = 6;
+        var colors = {{elev: '#4fc3f7', speed: '#ff8800'}};
+        var names = Object.keys(data);
+        var t0 = Infinity, t1 = -Infinity;
+        names.forEach(function(k) {{
+            t0 = Math.min(t0, data[k].t[0]);
+            t1 = Math.max(t1, data[k].t[data[k].t.length - 1]);
+        }});
+        function px(t) {{ return PAD + (t - t0) / Math.max(t1 - t0, 1) * (W - 2 * PAD); }}
+        function hhmm(t) {{
+            var d = new Date((t + 3 * 3600) * 1000);  // EAT = UTC+3
+            return ('0' + d.getUTCHours()).slice(-2) + ':' + ('0' + d.getUTCMinutes()).slice(-2);
+        }}
+        function nearest(s, t) {{
+            var lo = 0, hi = s.t.length - 1;
+            while (hi - lo > 1) {{ var mid = (lo + hi) >> 1; if (s.t[mid] < t) lo = mid; else hi = mid; }}
+            return (t - s.t[lo] < s.t[hi] - t) ? lo : hi;
+        }}
+        function draw(cursor) {{
+            ctx.clearRect(0, 0, W, H);
+            names.forEach(function(k) {{
+                var s = data[k], lo = Math.min.apply(null, s.v), hi = Math.max.apply(null, s.v);
+                ctx.strokeStyle = colors[k]; ctx.lineWidth = 1.5; ctx.beginPath();
+                for (var i = 0; i < s.t.length; i++) {{
+                    var y = H - PAD - (s.v[i] - lo) / Math.max(hi - lo, 1e-9) * (H - 2 * PAD);
+                    if (i) ctx.lineTo(px(s.t[i]), y); else ctx.moveTo(px(s.t[i]), y);
+                }}
+                ctx.stroke();
+            }});
+            if (cursor !== undefined) {{
+                ctx.strokeStyle = '#ffffff'; ctx.lineWidth = 1; ctx.beginPath();
+                ctx.moveTo(cursor, 0); ctx.lineTo(cursor, H); ctx.stroke();
+            }}
+        }}
+        if (!names.length) {{ document.getElementById('profile-panel').style.display = 'none'; return; }}
+        var marker = L.circleMarker([0, 0], {{radius: 8, color: '#ffffff', fillColor: '#ff00ff', fillOpacity: 1}});
+        canvas.addEventListener('mousemove', function(e) {{
+            var x = e.offsetX, t = t0 + (x - PAD) / (W - 2 * PAD) * (t1 - t0);
+            var text = [hhmm(t)];
+            names.forEach(function(k) {{
+                var s = data[k], i = nearest(s, t);
+                text.push(s.v[i] + (k === 'elev' ? ' m' : ' km/h'));
+                if (k === names[0]) marker.setLatLng(s.ll[i]).addTo(map);
+            }});
+            document.getElementById('profile-readout').innerText = text.join(' | ');
+            draw(x);
+        }});
+        canvas.addEventListener('mouseleave', function() {{
+            marker.remove();
+            document.getElementById('profile-readout').innerText = '';
+            draw();
+        }});
+        draw();
+    }});
+    </script>
+    '''
+
 
 def create_map(gpx, date_str: str, output_path, map_dark_mode: bool, use_offline):
     all_coords = []
     track_segments = []
     total_dist = 0
     total_duration = 0
-    stop_duration = 0
+    profile_samples = []
 
     for track in gpx.tracks:
         enriched = enrich_track(track)
@@ -20,22 +133,22 @@ def create_map(gpx, date_str: str, output_path, map_dark_mode: bool, use_offline
         all_coords.extend(coords)
         track_segments.append((coords, enriched))
 
-        # Calculate distance & duration
-        for i in range(1, len(enriched)):
-            total_dist += haversine(enriched[i-1]["coord"], enriched[i]["coord"])
-            if enriched[i]["duration"]:
-                total_duration += enriched[i]["duration"]
+        # Calculate distance & duration, collect chart samples
+        for i, p in enumerate(enriched):
+            if i:
+                total_dist += haversine(enriched[i-1]["coord"], p["coord"])
+                if p["duration"]:
+                    total_duration += p["duration"]
+            if p["time"]:
+                profile_samples.append((p["time"].timestamp(), p["elev"], p["speed"], *p["coord"]))
+    profile = build_profile(profile_samples)
 
     if not all_coords:
         return False, "No track data"
 
-    # Waypoints = stops
-    waypoints = sorted(gpx.waypoints, key=lambda wp: to_eat(wp.time) if wp.time else None)
-    for i in range(1, len(waypoints)):
-        if waypoints[i].time and waypoints[i-1].time:
-            delta = (to_eat(waypoints[i].time) - to_eat(waypoints[i-1].time)).total_seconds()
-            if delta > 60:  # Only count stops > 1 min
-                stop_duration += delta
+    # Waypoints = stops; times converted once, reused for stats and popups
+    waypoints = waypoint_times(gpx.waypoints)
+    stop_duration = stop_seconds(t for t, _ in waypoints)
 
     lats, lons = zip(*all_coords)
     center = [sum(lats)/len(lats), sum(lons)/len(lons)]
@@ -72,12 +185,13 @@ def create_map(gpx, date_str: str, output_path, map_dark_mode: bool, use_offline
         folium.Marker(last["coord"], popup=folium.Popup(f"<b>FINISH</b><br>Time: {last['time'].strftime('%H:%M') if last['time'] else '—'}", max_width=200),
                       icon=folium.Icon(color="darkred", icon="stop", prefix='fa')).add_to(m)
 
-    # Waypoints
-    for wp in gpx.waypoints:
-        t = to_eat(wp.time)
-        time_str = t.strftime('%H:%M') if t else '—'
-        folium.CircleMarker([wp.latitude, wp.longitude], radius=7, color="purple", fill=True,
-                            popup=folium.Popup(f"<b>{wp.name or 'Stop'}</b><br>Time: {time_str}", max_width=250)).add_to(m)
+    # Waypoints: one clustered layer, popups built on click
+    if waypoints:
+        rows = [[wp.latitude, wp.longitude, wp.name or 'Stop', t.strftime('%H:%M') if t else '—']
+                for t, wp in waypoints]
+        FastMarkerCluster(rows, callback=WAYPOINT_CALLBACK, name="Stops",
+                          removeOutsideVisibleBounds=True, disableClusteringAtZoom=17,
+                          spiderfyOnMaxZoom=False).add_to(m)
 
     MiniMap().add_to(m)
 
@@ -105,6 +219,10 @@ def create_map(gpx, date_str: str, output_path, map_dark_mode: bool, use_offline
     '''
     m.get_root().html.add_child(folium.Element(legend_html))
 
+    # Elevation / speed chart
+    if profile:
+        m.get_root().html.add_child(folium.Element(profile_chart_html(m.get_name(), profile)))
+
     # FOOTER: Stats + Signature
     hours, rem = divmod(total_duration, 3600)
     mins = rem // 60
@@ -126,3 +244,27 @@ def create_map(gpx, date_str: str, output_path, map_dark_mode: bool, use_offline
 
     m.save(str(output_path))
     return True, str(output_path)
+
+
+def create_history_map(tile_url, meta, map_dark_mode: bool):
+    """
+    "Where have we ever driven": base map + the pre-rendered route overlay.
+    The page only references tiles, so its size doesn't grow with history.
+    """
+    minzoom, maxzoom = int(meta.get("minzoom", 6)), int(meta.get("maxzoom", 15))
+    tile = 'cartodbdark_matter' if map_dark_mode else 'cartodbpositron'
+    m = folium.Map(location=[0.0236, 37.9062], zoom_start=minzoom, tiles=tile)  # Kenya
+    folium.TileLayer(
+        tiles=tile_url,
+        attr='Route history',
+        name='Route history',
+        overlay=True,
+        min_zoom=0,
+        min_native_zoom=minzoom,
+        max_native_zoom=maxzoom,
+    ).add_to(m)
+    if "bounds" in meta:
+        w, s, e, n = (float(v) for v in meta["bounds"].split(","))
+        m.fit_bounds([[s, w], [n, e]])
+    folium.LayerControl().add_to(m)
+    return m
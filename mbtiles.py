@@ -0,0 +1,182 @@
+# mbtiles.py
+"""
+MBTiles helpers. Two layouts are supported everywhere:
+- flat:         `tiles` table holding every blob
+- deduplicated: `map` (coords → tile_id) + `images` (tile_id → blob), with a
+                `tiles` view on top so readers see the flat layout
+"""
+import hashlib
+import shutil
+import sqlite3
+import sys
+from pathlib import Path
+
+# Standard MBTiles 1.3 layout; rows are TMS (y flipped)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT);
+CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name);
+CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+"""
+
+DEDUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT);
+CREATE UNIQUE INDEX IF NOT EXISTS map_index ON map (zoom_level, tile_column, tile_row);
+CREATE TABLE IF NOT EXISTS images (tile_data BLOB, tile_id TEXT);
+CREATE UNIQUE INDEX IF NOT EXISTS images_id ON images (tile_id);
+"""
+
+TILES_VIEW = """
+CREATE VIEW tiles AS
+    SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+           map.tile_row AS tile_row, images.tile_data AS tile_data
+    FROM map JOIN images ON images.tile_id = map.tile_id;
+"""
+
+
+def tile_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def tms_row(z, y):
+    """XYZ row ↔ TMS row (the flip is its own inverse)"""
+    return (1 << z) - 1 - y
+
+
+def _object_type(conn, name):
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name=?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def is_deduplicated(conn):
+    return _object_type(conn, "tiles") == "view" and _object_type(conn, "map") == "table"
+
+
+def open_readonly(path):
+    """Read-only connection for serving/validating tiles"""
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+
+def is_valid_mbtiles(path):
+    """Check if file is a valid MBTiles database (flat or deduplicated)"""
+    path = Path(path)
+    if not path.exists() or path.stat().st_size < 1000:
+        return False
+    try:
+        conn = open_readonly(path)
+        try:
+            return (_object_type(conn, "metadata") == "table"
+                    and _object_type(conn, "tiles") in ("table", "view"))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+
+
+def open_mbtiles(path):
+    """Open (or create, flat) an MBTiles file for writing"""
+    conn = sqlite3.connect(str(path))
+    conn.create_function("tile_hash", 1, tile_hash, deterministic=True)
+    if is_deduplicated(conn):
+        conn.executescript(DEDUP_SCHEMA)
+    else:
+        conn.executescript(SCHEMA)
+    return conn
+
+
+def get_metadata(conn):
+    return dict(conn.execute("SELECT name, value FROM metadata"))
+
+
+def set_metadata(conn, **values):
+    conn.executemany("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                     [(k, str(v)) for k, v in values.items()])
+
+
+def read_tile(conn, z, x, y):
+    """Tile bytes for XYZ coordinates, or None"""
+    row = conn.execute(
+        "SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+        (z, x, tms_row(z, y))).fetchone()
+    return row[0] if row else None
+
+
+def write_tiles(conn, tiles):
+    """Insert/replace (z, x, y, data) tuples in XYZ coordinates; caller commits"""
+    if not is_deduplicated(conn):
+        conn.executemany(
+            "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+            [(z, x, tms_row(z, y), data) for z, x, y, data in tiles])
+        return
+    rows = [(z, x, tms_row(z, y), data, tile_hash(data)) for z, x, y, data in tiles]
+    conn.executemany("INSERT OR IGNORE INTO images (tile_data, tile_id) VALUES (?, ?)",
+                     [(data, h) for *_, data, h in rows])
+    conn.executemany("INSERT OR REPLACE INTO map (zoom_level, tile_column, tile_row, tile_id) VALUES (?, ?, ?, ?)",
+                     [(z, x, row, h) for z, x, row, _, h in rows])
+
+
+def _size(path):
+    return Path(path).stat().st_size
+
+
+def deduplicate(path, dest=None):
+    """
+    Convert a flat MBTiles to the deduplicated layout (in place, or into a copy
+    at dest) and VACUUM. Returns stats incl. bytes saved.
+    """
+    path = Path(path)
+    before = _size(path)
+    if dest:
+        shutil.copyfile(path, dest)
+        path = Path(dest)
+    conn = open_mbtiles(path)
+    try:
+        if is_deduplicated(conn):
+            print(f"{path.name} is already deduplicated")
+        else:
+            # One transaction: a failure leaves the flat layout untouched
+            conn.executescript("BEGIN;" + DEDUP_SCHEMA + """
+                INSERT OR REPLACE INTO map SELECT zoom_level, tile_column, tile_row, tile_hash(tile_data) FROM tiles;
+                INSERT OR IGNORE INTO images (tile_data, tile_id) SELECT tile_data, tile_hash(tile_data) FROM tiles;
+                DROP TABLE tiles;
+            """ + TILES_VIEW + "COMMIT;")
+        tiles, images = (conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("map", "images"))
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return _report(path, before, tiles=tiles, images=images)
+
+
+def compact(path):
+    """Drop images no tile points to any more, then VACUUM. Works on both layouts."""
+    path = Path(path)
+    before = _size(path)
+    conn = open_mbtiles(path)
+    try:
+        if is_deduplicated(conn):
+            with conn:
+                conn.execute("DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map)")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return _report(path, before)
+
+
+def _report(path, before, **stats):
+    after = _size(path)
+    stats.update(before=before, after=after, saved=before - after)
+    pct = (before - after) / before * 100 if before else 0
+    extra = f" ({stats['tiles']} tiles → {stats['images']} unique images)" if "tiles" in stats else ""
+    print(f"{path.name}: {before/1e6:.1f} MB → {after/1e6:.1f} MB, saved {pct:.1f}%{extra}")
+    return stats
+
+
+if __name__ == '__main__':
+    # python mbtiles.py dedupe <file> [dest] | python mbtiles.py compact <file>
+    cmd, target = sys.argv[1], sys.argv[2]
+    if cmd == "dedupe":
+        deduplicate(target, sys.argv[3] if len(sys.argv) > 3 else None)
+    elif cmd == "compact":
+        compact(target)
+    else:
+        print(f"Unknown command: {cmd} (use dedupe or compact)")
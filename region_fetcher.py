@@ -0,0 +1,310 @@
+# region_fetcher.py
+"""
+Fetch XYZ tiles for a region from a tile server into MBTiles.
+
+- Region = bbox or route corridor, over a zoom range
+- Concurrent workers, one keep-alive connection per worker thread
+- Global rate limit, retries with backoff on errors / 429 / 5xx
+- Tiles already in the MBTiles, or known to be empty (204/404), are skipped
+- Writes go out in large batched transactions
+"""
+import argparse
+import http.client
+import math
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from urllib.parse import urlsplit
+import numpy as np
+from tqdm import tqdm
+from config import TILES_DIR
+from gpx_parser import parse_gpx_file, enrich_track
+from mbtiles import open_mbtiles, get_metadata, set_metadata, write_tiles, tms_row
+from utils import latlon_to_pixels, TILE_SIZE
+
+WORKERS = 8
+RATE = 50.0        # Requests per second, all workers combined
+RETRIES = 4
+BATCH = 1000       # Tiles per write transaction
+TIMEOUT = 30
+USER_AGENT = "geo-mapper/1.0"
+
+
+class TileServerError(ValueError):
+    """Non-retryable client error (401/403/400…): the whole run is aborted"""
+
+
+def tiles_for_bbox(min_lon, min_lat, max_lon, max_lat, zooms):
+    """All (z, x, y) covering the bbox"""
+    for z in zooms:
+        (x0, x1), (y1, y0) = latlon_to_pixels([min_lat, max_lat], [min_lon, max_lon], z)
+        last = (1 << z) - 1
+        for x in range(max(int(x0) // TILE_SIZE, 0), min(int(x1) // TILE_SIZE, last) + 1):
+            for y in range(max(int(y0) // TILE_SIZE, 0), min(int(y1) // TILE_SIZE, last) + 1):
+                yield z, x, y
+
+
+def tiles_for_route(lats, lons, zooms, buffer=1):
+    """(z, x, y) along a route, widened by `buffer` tiles on each side"""
+    for z in zooms:
+        px, py = latlon_to_pixels(lats, lons, z)
+        # Walk segments in half-tile steps so no crossed tile is missed
+        tx, ty = px / TILE_SIZE, py / TILE_SIZE
+        steps = np.ceil(np.maximum(np.abs(np.diff(tx)), np.abs(np.diff(ty))) * 2).astype(np.int64) + 1
+        seg = np.repeat(np.arange(len(steps)), steps)
+        t = (np.arange(len(seg)) - (np.cumsum(steps) - steps)[seg]) / np.maximum(steps[seg] - 1, 1)
+        cx = (tx[seg] + t * np.diff(tx)[seg]).astype(np.int64)
+        cy = (ty[seg] + t * np.diff(ty)[seg]).astype(np.int64)
+        cells = set()
+        for dx in range(-buffer, buffer + 1):
+            for dy in range(-buffer, buffer + 1):
+                cells.update(zip((cx + dx).tolist(), (cy + dy).tolist()))
+        last = (1 << z) - 1
+        for x, y in sorted(cells):
+            if 0 <= x <= last and 0 <= y <= last:
+                yield z, x, y
+
+
+def tile_to_lonlat(x, y, z):
+    """North-west corner of tile (x, y) at zoom z"""
+    n = 1 << z
+    return x / n * 360 - 180, math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+
+def corridor_bounds(lats, lons, zooms, buffer=1):
+    """Bounds of the route widened by `buffer` tiles at the lowest zoom (the widest)"""
+    z = min(zooms)
+    (x0, x1), (y1, y0) = latlon_to_pixels([lats.min(), lats.max()], [lons.min(), lons.max()], z)
+    last = (1 << z) - 1
+    w, n = tile_to_lonlat(max(int(x0) // TILE_SIZE - buffer, 0), max(int(y0) // TILE_SIZE - buffer, 0), z)
+    e, s = tile_to_lonlat(min(int(x1) // TILE_SIZE + buffer, last) + 1,
+                          min(int(y1) // TILE_SIZE + buffer, last) + 1, z)
+    return [w, s, e, n]
+
+
+def merge_bounds(a, b):
+    """Union of two [w, s, e, n] boxes (either may be None)"""
+    if not a or not b:
+        return a or b
+    return [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+
+
+def route_coords(path):
+    """All track points of a GPX source as (lats, lons) arrays"""
+    gpx = parse_gpx_file(path)
+    coords = [p["coord"] for track in gpx.tracks for p in enrich_track(track)]
+    if len(coords) < 2:
+        raise ValueError(f"No track data in {Path(str(path)).name}")
+    lats, lons = np.array(coords).T
+    return lats, lons
+
+
+class RateLimiter:
+    """Token bucket shared by all workers"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class TileClient:
+    """Per-thread keep-alive connections to one tile server"""
+
+    def __init__(self, url_template, rate=RATE, retries=RETRIES, headers=None):
+        parts = urlsplit(url_template)
+        self.scheme, self.host = parts.scheme, parts.netloc
+        self.path = url_template.split(parts.netloc, 1)[1]
+        self.headers = {"User-Agent": USER_AGENT, **(headers or {})}
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            conn = self.local.conn = cls(self.host, timeout=TIMEOUT)
+        return conn
+
+    def _reset(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self.local.conn = None
+
+    def fetch(self, z, x, y):
+        """Tile bytes, or None if the server has no such tile (404/204)"""
+        path = self.path.format(z=z, x=x, y=y)
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                conn = self._connection()
+                conn.request("GET", path, headers=self.headers)
+                resp = conn.getresponse()
+                body = resp.read()  # Always drain so the connection can be reused
+                if resp.status == 200:
+                    return body
+                if resp.status in (204, 404):
+                    return None
+                if resp.status != 429 and resp.status < 500:
+                    raise TileServerError(f"HTTP {resp.status} {resp.reason} for {path}")
+                if resp.getheader("Connection", "").lower() == "close":
+                    self._reset()
+            except (OSError, http.client.HTTPException):
+                self._reset()
+                if attempt == self.retries:
+                    raise
+            if attempt < self.retries:  # No point backing off before giving up
+                time.sleep(min(2 ** attempt * 0.5, 10))
+        raise ValueError(f"Gave up on {z}/{x}/{y} after {self.retries + 1} attempts")
+
+
+# Tiles the server answered 204/404 for (XYZ), so reruns don't ask again
+MISSING_SCHEMA = """
+CREATE TABLE IF NOT EXISTS missing_tiles (z INTEGER, x INTEGER, y INTEGER, PRIMARY KEY (z, x, y));
+"""
+
+
+def existing_tiles(conn, include_missing=True):
+    """Set of XYZ coordinates already stored (and, by default, known to be empty)"""
+    have = {(z, x, tms_row(z, row)) for z, x, row in
+            conn.execute("SELECT zoom_level, tile_column, tile_row FROM tiles")}
+    if include_missing:
+        have.update(conn.execute("SELECT z, x, y FROM missing_tiles"))
+    return have
+
+
+def fetch_region(url_template, dest, tiles, workers=WORKERS, rate=RATE, retries=RETRIES,
+                 headers=None, batch=BATCH, name=None, bounds=None, retry_missing=False):
+    """
+    Download `tiles` (iterable of XYZ (z, x, y)) into MBTiles `dest`.
+    Returns stats: fetched, skipped, missing, failed, seconds, tiles_per_sec.
+    Tiles the server has no data for are remembered and skipped next time,
+    unless retry_missing is set.
+    Raises TileServerError on a non-retryable 4xx (bad token, blocked…);
+    tiles fetched up to that point are kept.
+    """
+    dest = Path(dest)
+    conn = open_mbtiles(dest)
+    conn.executescript(MISSING_SCHEMA)
+    client = TileClient(url_template, rate=rate, retries=retries, headers=headers)
+    stats = {"fetched": 0, "skipped": 0, "missing": 0, "failed": 0}
+    buffer = []
+    missing = []
+    zooms = set()
+
+    def flush():
+        write_tiles(conn, buffer)
+        conn.executemany("DELETE FROM missing_tiles WHERE z=? AND x=? AND y=?", [t[:3] for t in buffer])
+        conn.executemany("INSERT OR IGNORE INTO missing_tiles VALUES (?, ?, ?)", missing)
+        conn.commit()
+        buffer.clear()
+        missing.clear()
+
+    def collect(done):
+        for future in done:
+            coord = futures.pop(future)
+            try:
+                data = future.result()
+            except TileServerError:
+                for pending in futures:  # Auth/client errors hit every tile: stop now
+                    pending.cancel()
+                raise
+            except Exception as e:
+                stats["failed"] += 1
+                tqdm.write(f"[WARN] Tile {coord} failed: {e}")
+                continue
+            if data is None:
+                missing.append(coord)
+                stats["missing"] += 1
+            else:
+                buffer.append((*coord, data))
+                stats["fetched"] += 1
+            pbar.update(1)
+        if len(buffer) + len(missing) >= batch:
+            flush()
+
+    try:
+        have = existing_tiles(conn, include_missing=not retry_missing)
+        start = time.monotonic()
+        futures = {}
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool, \
+                    tqdm(unit="tile", desc=dest.name) as pbar:
+                for coord in tiles:
+                    zooms.add(coord[0])
+                    if coord in have:
+                        stats["skipped"] += 1
+                        continue
+                    futures[pool.submit(client.fetch, *coord)] = coord
+                    if len(futures) >= workers * 4:  # Bounded in-flight queue
+                        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        collect(done)
+                collect(wait(futures)[0])
+        finally:
+            flush()  # Also keeps what was fetched before an abort
+
+        meta = get_metadata(conn)
+        if zooms:
+            lo = min(zooms | {int(meta.get("minzoom", 99))})
+            hi = max(zooms | {int(meta.get("maxzoom", -1))})
+            fmt = meta.get("format") or Path(urlsplit(url_template).path).suffix.lstrip(".") or "png"
+            old = [float(v) for v in meta["bounds"].split(",")] if "bounds" in meta else None
+            bounds = merge_bounds(old, bounds)
+            set_metadata(conn, name=meta.get("name") or name or dest.stem, format=fmt,
+                         minzoom=lo, maxzoom=hi,
+                         **({"bounds": ",".join(f"{v:.6f}" for v in bounds)} if bounds else {}))
+            conn.commit()
+    finally:
+        conn.close()
+
+    elapsed = time.monotonic() - start
+    stats["seconds"] = round(elapsed, 2)
+    stats["tiles_per_sec"] = round(stats["fetched"] / elapsed, 1) if elapsed else 0.0
+    print(f"{dest.name}: {stats['fetched']} fetched, {stats['skipped']} skipped, "
+          f"{stats['missing']} missing, {stats['failed']} failed — {stats['tiles_per_sec']} tiles/s")
+    return stats
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Fetch a region of XYZ tiles into MBTiles")
+    ap.add_argument("url", help="Tile URL template, e.g. http://tiles.local/{z}/{x}/{y}.png")
+    ap.add_argument("--bbox", help="min_lon,min_lat,max_lon,max_lat")
+    ap.add_argument("--route", help="GPX file; fetch a corridor around it")
+    ap.add_argument("--buffer", type=int, default=1, help="Corridor width in tiles (route only)")
+    ap.add_argument("--zoom", default="6-14", help="Zoom range, e.g. 6-14")
+    ap.add_argument("--out", default=str(TILES_DIR / "region.mbtiles"))
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--rate", type=float, default=RATE, help="Max requests/sec (0 = unlimited)")
+    ap.add_argument("--retry-missing", action="store_true", help="Ask again for tiles the server had no data for")
+    args = ap.parse_args()
+
+    lo, _, hi = args.zoom.partition("-")
+    zooms = range(int(lo), int(hi or lo) + 1)
+    if args.bbox:
+        bbox = [float(v) for v in args.bbox.split(",")]
+        coords = tiles_for_bbox(*bbox, zooms)
+    elif args.route:
+        lats, lons = route_coords(args.route)
+        bbox = corridor_bounds(lats, lons, zooms, args.buffer)
+        coords = tiles_for_route(lats, lons, zooms, args.buffer)
+    else:
+        ap.error("give --bbox or --route")
+    try:
+        fetch_region(args.url, args.out, coords, workers=args.workers, rate=args.rate, bounds=bbox,
+                     retry_missing=args.retry_missing)
+    except TileServerError as e:
+        sys.exit(f"Aborted: {e}")
@@ -0,0 +1,260 @@
+# route_overlay.py
+"""
+Rasterize every route in the catalog into a PNG tile pyramid stored as
+an overlay MBTiles (config.OVERLAY_FILE).
+
+Incremental: each tile's raw per-pixel values are kept in the
+`overlay_acc` table (XYZ coordinates), and rendered sources are recorded in
+`overlay_routes` with their size/mtime and content hash. Unchanged files
+are skipped on stat alone; the hash stops copies or moved files from being
+counted twice. Adding routes only re-renders the tiles they touch.
+
+Modes:
+- "speed"     → highest speed band seen on each pixel (speed_to_color bands)
+- "frequency" → number of routes (GPX sources) that crossed each pixel
+
+View with `python history_server.py` (or the GUI's Update History button).
+"""
+import hashlib
+import struct
+import sys
+import zlib
+from pathlib import Path
+import numpy as np
+from config import OVERLAY_FILE
+from gpx_parser import parse_gpx_file, enrich_track, list_gpx_sources, open_gpx_stream, source_name, ARCHIVE_SEP
+from mbtiles import open_mbtiles, get_metadata, set_metadata, write_tiles
+from utils import latlon_to_pixels, TILE_SIZE
+
+OVERLAY_ZOOMS = range(6, 16)
+MODES = ("speed", "frequency")
+CHUNK_ROUTES = 50  # Routes rasterized before touched tiles are flushed
+
+# Value → RGBA. 0 is always transparent.
+PALETTES = {
+    # 1 = unknown speed, 2..6 = <5, 5–15, 15–30, 30–50, 50+ km/h
+    "speed": np.array([
+        (0, 0, 0, 0), (136, 136, 136, 200), (0, 255, 0, 220), (136, 255, 0, 220),
+        (255, 255, 0, 220), (255, 136, 0, 220), (255, 0, 0, 220),
+    ], dtype=np.uint8),
+    # 1, 2–3, 4–7, 8–15, 16+ routes
+    "frequency": np.array([
+        (0, 0, 0, 0), (65, 105, 225, 180), (0, 191, 255, 200), (0, 255, 127, 210),
+        (255, 215, 0, 220), (255, 69, 0, 230),
+    ], dtype=np.uint8),
+}
+SPEED_BANDS_KMH = [5, 15, 30, 50]
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS overlay_acc (zoom INTEGER, x INTEGER, y INTEGER, acc BLOB,
+    PRIMARY KEY (zoom, x, y));
+CREATE TABLE IF NOT EXISTS overlay_routes (source TEXT PRIMARY KEY, size INTEGER, mtime REAL, digest TEXT);
+CREATE INDEX IF NOT EXISTS overlay_routes_digest ON overlay_routes (digest);
+"""
+
+
+def speed_bands(speed_mps):
+    """Per-point speed (m/s, nan = unknown) → palette value 1..6"""
+    kmh = np.asarray(speed_mps, dtype=float) * 3.6
+    bands = np.digitize(kmh, SPEED_BANDS_KMH) + 2
+    bands[np.isnan(kmh)] = 1
+    return bands.astype(np.uint16)
+
+
+def route_lines(gpx):
+    """(lats, lons, speed bands) per track, as in create_map"""
+    lines = []
+    for track in gpx.tracks:
+        enriched = enrich_track(track)
+        if len(enriched) < 2:
+            continue
+        lats, lons = np.array([p["coord"] for p in enriched], dtype=float).T
+        speeds = np.array([p["speed"] for p in enriched], dtype=float)
+        lines.append((lats, lons, speed_bands(speeds)))
+    return lines
+
+
+def rasterize_line(lats, lons, bands, zoom):
+    """
+    Walk each segment in ≤1 px steps; returns global pixel ids (y * width + x)
+    and the band of the segment that drew them. Lines are 2 px wide.
+    """
+    px, py = latlon_to_pixels(lats, lons, zoom)
+    dx, dy = np.diff(px), np.diff(py)
+    steps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64) + 1
+    seg = np.repeat(np.arange(len(dx)), steps)
+    start = np.cumsum(steps) - steps
+    t = (np.arange(len(seg)) - start[seg]) / np.maximum(steps[seg] - 1, 1)
+    x = (px[seg] + t * dx[seg]).astype(np.int64)
+    y = (py[seg] + t * dy[seg]).astype(np.int64)
+    width = TILE_SIZE << zoom
+    x = np.concatenate([x, x + 1, x, x + 1]).clip(0, width - 1)
+    y = np.concatenate([y, y, y + 1, y + 1]).clip(0, width - 1)
+    return y * width + x, np.tile(bands[1:][seg], 4)
+
+
+def merge_pixels(ids, values, mode):
+    """Collapse duplicate pixels: max band (speed) or a single visit (frequency)"""
+    order = np.lexsort((values, ids))
+    ids, values = ids[order], values[order]
+    last = np.append(ids[1:] != ids[:-1], True)  # Last of each run holds the max
+    ids, values = ids[last], values[last]
+    if mode == "frequency":
+        values = np.ones_like(values)
+    return ids, values
+
+
+def frequency_levels(acc):
+    """Route counts → palette value 1..5 (log2 buckets)"""
+    levels = np.zeros(acc.shape, dtype=np.uint16)
+    hit = acc > 0
+    levels[hit] = np.minimum(np.floor(np.log2(acc[hit])) + 1, 5)
+    return levels
+
+
+def encode_png(rgba):
+    """(H, W, 4) uint8 → PNG bytes"""
+    h, w, _ = rgba.shape
+    raw = np.concatenate([np.zeros((h, 1), np.uint8), rgba.reshape(h, w * 4)], axis=1)
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+            + chunk(b"IEND", b""))
+
+
+def render_tile(acc, mode):
+    levels = frequency_levels(acc) if mode == "frequency" else acc
+    return encode_png(PALETTES[mode][levels])
+
+
+def flush(conn, pending, mode):
+    """Fold pending pixels into stored accumulators and re-render touched tiles"""
+    written = 0
+    for zoom, parts in pending.items():
+        if not parts:
+            continue
+        ids = np.concatenate([p[0] for p in parts])
+        values = np.concatenate([p[1] for p in parts])
+        width = TILE_SIZE << zoom
+        gx, gy = ids % width, ids // width
+        tiles = (gy // TILE_SIZE) * (1 << zoom) + gx // TILE_SIZE
+        local = (gy % TILE_SIZE) * TILE_SIZE + gx % TILE_SIZE
+        order = np.argsort(tiles, kind="stable")
+        tiles, local, values = tiles[order], local[order], values[order]
+        bounds = np.flatnonzero(np.diff(tiles)) + 1
+
+        rendered = []
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(tiles)]):
+            ty, tx = divmod(int(tiles[lo]), 1 << zoom)
+            row = conn.execute(
+                "SELECT acc FROM overlay_acc WHERE zoom=? AND x=? AND y=?",
+                (zoom, tx, ty)).fetchone()
+            acc = (np.frombuffer(zlib.decompress(row[0]), np.uint16).copy() if row
+                   else np.zeros(TILE_SIZE * TILE_SIZE, np.uint16))
+            if mode == "frequency":
+                np.add.at(acc, local[lo:hi], values[lo:hi])
+            else:
+                np.maximum.at(acc, local[lo:hi], values[lo:hi])
+            conn.execute("INSERT OR REPLACE INTO overlay_acc VALUES (?, ?, ?, ?)",
+                         (zoom, tx, ty, zlib.compress(acc.tobytes())))
+            rendered.append((zoom, tx, ty, render_tile(acc.reshape(TILE_SIZE, TILE_SIZE), mode)))
+        write_tiles(conn, rendered)
+        written += len(rendered)
+        parts.clear()
+    return written
+
+
+def source_stat(source):
+    """(size, mtime) of the file holding a source (the archive for zip members)"""
+    st = Path(str(source).split(ARCHIVE_SEP, 1)[0]).stat()
+    return st.st_size, st.st_mtime
+
+
+def source_key(source):
+    """Content hash of a source, so moved or re-pathed routes are not counted twice"""
+    digest = hashlib.sha1()
+    with open_gpx_stream(source) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_overlay(sources, path=OVERLAY_FILE, mode="speed", zooms=OVERLAY_ZOOMS):
+    """
+    Add routes not yet in the overlay. Returns (routes added, tiles written).
+    Sources that fail to read are not recorded, so a later run retries them.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown overlay mode: {mode}")
+    conn = open_mbtiles(path)
+    try:
+        conn.executescript(STATE_SCHEMA)
+        meta = get_metadata(conn)
+        if meta.get("mode", mode) != mode:
+            raise ValueError(f"{Path(path).name} was built in '{meta['mode']}' mode; delete it to rebuild")
+        known = {src: (size, mtime) for src, size, mtime in
+                 conn.execute("SELECT source, size, mtime FROM overlay_routes")}
+        done = {r[0] for r in conn.execute("SELECT DISTINCT digest FROM overlay_routes")}
+        todo = []
+        for source in map(str, sources):
+            try:
+                stat = source_stat(source)
+                if known.get(source) == stat:
+                    continue  # Unchanged since last run: no need to read it
+                key = source_key(source)
+            except Exception as e:
+                print(f"[WARN] Cannot read {source_name(source)}: {e}")
+                continue
+            if key in done:  # Copy or move of a rendered route
+                conn.execute("INSERT OR REPLACE INTO overlay_routes VALUES (?, ?, ?, ?)", (source, *stat, key))
+            else:
+                done.add(key)
+                todo.append((key, source, stat))
+        conn.commit()
+
+        zooms = list(zooms)
+        pending = {z: [] for z in zooms}
+        bounds = [float(v) for v in meta["bounds"].split(",")] if "bounds" in meta else None
+        added = written = 0
+        for i, (key, source, stat) in enumerate(todo, 1):
+            try:
+                lines = route_lines(parse_gpx_file(source))
+            except ValueError as e:
+                print(f"[WARN] {e}")
+                lines = None
+            if lines is not None:
+                for lats, lons, _ in lines:
+                    box = [lons.min(), lats.min(), lons.max(), lats.max()]
+                    bounds = box if bounds is None else [
+                        min(bounds[0], box[0]), min(bounds[1], box[1]),
+                        max(bounds[2], box[2]), max(bounds[3], box[3])]
+                for z in (zooms if lines else []):
+                    # All tracks of a source together: it counts once per pixel
+                    drawn = [rasterize_line(lats, lons, bands, z) for lats, lons, bands in lines]
+                    pending[z].append(merge_pixels(np.concatenate([d[0] for d in drawn]),
+                                                   np.concatenate([d[1] for d in drawn]), mode))
+                conn.execute("INSERT OR REPLACE INTO overlay_routes VALUES (?, ?, ?, ?)", (source, *stat, key))
+                added += bool(lines)
+
+            if i % CHUNK_ROUTES == 0 or i == len(todo):
+                written += flush(conn, pending, mode)
+                set_metadata(conn, name="Route history", format="png", type="overlay",
+                             mode=mode, minzoom=min(zooms), maxzoom=max(zooms),
+                             **({"bounds": ",".join(f"{v:.6f}" for v in bounds)} if bounds else {}))
+                conn.commit()
+                print(f"Overlay: {i}/{len(todo)} routes, {written} tiles written")
+        return added, written
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    # python route_overlay.py <routes folder> [speed|frequency]
+    folder = sys.argv[1]
+    added, written = build_overlay(list_gpx_sources(folder), mode=sys.argv[2] if len(sys.argv) > 2 else "speed")
+    print(f"Added {added} routes, wrote {written} tiles → {OVERLAY_FILE}")
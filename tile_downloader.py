@@ -1,7 +1,7 @@
 import urllib.request
 from pathlib import Path
-import sqlite3
 from tqdm import tqdm
+from mbtiles import is_valid_mbtiles
 
 TILES_DIR = Path(__file__).parent / "tiles"
 TILES_DIR.mkdir(exist_ok=True)
@@ -21,18 +21,6 @@ def download_with_progress(url, dest):
                 pbar.update(len(chunk))
     print("Download complete.")
 
-def is_valid_mbtiles(path):
-    """Check if file is a valid MBTiles database"""
-    if not path.exists() or path.stat().st_size < 1000:
-        return False
-    try:
-        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
-        conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='metadata';")
-        conn.close()
-        return True
-    except:
-        return False
-
 def ensure_kenya_tiles():
     """Download Kenya tiles if missing or corrupt"""
     if KENYA_FILE.exists() and is_valid_mbtiles(KENYA_FILE):
@@ -0,0 +1,188 @@
+# track_export.py
+"""
+Export enriched tracks as columnar datasets for analytics.
+
+Layout (hive-partitioned by route date, one part file per source):
+    <out>/points/date=YYYY-MM-DD/<file>.parquet     per-point rows
+    <out>/summaries/date=YYYY-MM-DD/<file>.parquet  one row per source
+
+Re-running only exports sources that are new or changed since their part
+file was written, so the datasets grow by appending files.
+Needs pyarrow (optional dependency).
+"""
+import hashlib
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from config import EXPORT_DIR
+from gpx_parser import (parse_gpx_file, enrich_track, stop_seconds, waypoint_times, list_gpx_sources,
+                        safe_date_from_filename, source_name, to_eat, ARCHIVE_SEP)
+from utils import haversine
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise ValueError("pyarrow is required for export (pip install pyarrow)")
+
+
+def source_label(source) -> str:
+    """Source relative to its folder: 'x.gpx' or 'bundle.zip::member.gpx'"""
+    path, sep, member = str(source).partition(ARCHIVE_SEP)
+    return Path(path).name + sep + member
+
+
+def file_id(source) -> str:
+    """
+    Filesystem-safe id of a source, unique within its folder.
+    Sanitising alone can collide ('a b.gpx' vs 'a_b.gpx'), so a short hash
+    of the label is appended.
+    """
+    label = source_label(source)
+    safe = re.sub(r'[^\w.-]', '_', label.replace(ARCHIVE_SEP, '__'))
+    return f"{safe}-{hashlib.sha1(label.encode('utf-8')).hexdigest()[:10]}"
+
+
+def source_mtime(source) -> float:
+    return Path(str(source).split(ARCHIVE_SEP, 1)[0]).stat().st_mtime
+
+
+def track_columns(gpx, file: str):
+    """Enriched points as columns plus the per-file summary row"""
+    cols = {k: [] for k in ("file", "track", "segment", "time", "lat", "lon",
+                            "elev", "speed", "duration")}
+    dist = 0
+    tracks = 0
+    for t_idx, track in enumerate(gpx.tracks):
+        enriched = enrich_track(track)
+        if not enriched:
+            continue
+        tracks += 1
+        for i, p in enumerate(enriched):
+            if i:
+                dist += haversine(enriched[i-1]["coord"], p["coord"])
+            cols["file"].append(file)
+            cols["track"].append(t_idx)
+            cols["segment"].append(p["segment"])
+            cols["time"].append(p["time"])
+            cols["lat"].append(p["coord"][0])
+            cols["lon"].append(p["coord"][1])
+            cols["elev"].append(p["elev"])
+            cols["speed"].append(p["speed"])
+            cols["duration"].append(p["duration"])
+
+    times = [t for t in cols["time"] if t]
+    speeds = [s for s in cols["speed"] if s is not None]
+    elevs = [e for e in cols["elev"] if e is not None]
+    summary = {
+        "file": [file],
+        "tracks": [tracks],
+        "points": [len(cols["file"])],
+        "start_time": [min(times) if times else None],
+        "end_time": [max(times) if times else None],
+        "distance_m": [dist],
+        "duration_s": [sum(d for d in cols["duration"] if d)],
+        "stop_s": [stop_seconds(t for t, _ in waypoint_times(gpx.waypoints))],
+        "max_speed_mps": [max(speeds) if speeds else None],
+        "min_elev": [min(elevs) if elevs else None],
+        "max_elev": [max(elevs) if elevs else None],
+    }
+    return cols, summary
+
+
+def _schemas(pa):
+    ts = pa.timestamp('ms', tz='Africa/Nairobi')
+    points = pa.schema([
+        ("file", pa.string()), ("track", pa.int32()), ("segment", pa.int32()),
+        ("time", ts), ("lat", pa.float64()), ("lon", pa.float64()),
+        ("elev", pa.float64()), ("speed", pa.float64()), ("duration", pa.float64()),
+    ])
+    summaries = pa.schema([
+        ("file", pa.string()), ("tracks", pa.int32()), ("points", pa.int64()),
+        ("start_time", ts), ("end_time", ts), ("distance_m", pa.float64()),
+        ("duration_s", pa.float64()), ("stop_s", pa.float64()),
+        ("max_speed_mps", pa.float64()), ("min_elev", pa.float64()), ("max_elev", pa.float64()),
+    ])
+    return points, summaries
+
+
+def _write(pa, table, path, fmt):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    if fmt == "parquet":
+        pa.parquet.write_table(table, tmp, compression="zstd")
+    else:
+        pa.feather.write_feather(table, tmp, compression="zstd")
+    tmp.replace(path)  # Readers never see half-written parts
+
+
+def export_source(source, out_dir=EXPORT_DIR, fmt="parquet"):
+    """
+    Export one source if new or changed. Returns 'exported', 'skipped' or 'no data'.
+    Runs in worker processes.
+    """
+    pa = _pyarrow()
+    out_dir = Path(out_dir)
+    name = source_name(source)
+    part = f"{file_id(source)}{FORMATS[fmt]}"
+
+    # Up-to-date check before any parsing; the date partition may not be known yet
+    mtime = source_mtime(source)
+    if any(p.stat().st_mtime >= mtime for p in (out_dir / "summaries").glob(f"date=*/{part}")):
+        return "skipped"
+
+    gpx = parse_gpx_file(source)
+    date = safe_date_from_filename(name)
+    if date is None:
+        first = next((p.time for t in gpx.tracks for s in t.segments for p in s.points if p.time), None)
+        date = to_eat(first).date().isoformat() if first else "unknown"
+
+    points_path = out_dir / "points" / f"date={date}" / part
+    summary_path = out_dir / "summaries" / f"date={date}" / part
+    cols, summary = track_columns(gpx, source_label(source))
+    if not cols["file"]:
+        return "no data"
+    for stale in (*(out_dir / "points").glob(f"date=*/{part}"), *(out_dir / "summaries").glob(f"date=*/{part}")):
+        if stale not in (points_path, summary_path):  # Source moved to another date
+            stale.unlink()
+    points_schema, summary_schema = _schemas(pa)
+    _write(pa, pa.table(cols, schema=points_schema), points_path, fmt)
+    _write(pa, pa.table(summary, schema=summary_schema), summary_path, fmt)
+    return "exported"
+
+
+def export_tracks(sources, out_dir=EXPORT_DIR, fmt="parquet", workers=None):
+    """
+    Export many sources in parallel. Returns {'exported': n, 'skipped': n, ...}.
+    Parse failures are reported and counted as 'failed'.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    _pyarrow()  # Fail fast, before spawning workers
+    counts = {}
+    sources = [str(s) for s in sources]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(export_source, s, str(out_dir), fmt) for s in sources]
+        for source, future in zip(sources, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"[WARN] Export failed for {source_name(source)}: {e}")
+                result = "failed"
+            counts[result] = counts.get(result, 0) + 1
+    return counts
+
+
+if __name__ == '__main__':
+    # python track_export.py <routes folder> [out dir] [parquet|arrow]
+    folder = sys.argv[1]
+    out = Path(sys.argv[2]) if len(sys.argv) > 2 else EXPORT_DIR
+    counts = export_tracks(list_gpx_sources(folder), out, sys.argv[3] if len(sys.argv) > 3 else "parquet")
+    print(f"Export → {out}: {counts}")
@@ -1,5 +1,6 @@
 # utils.py
 import math
+import numpy as np
 
 def haversine(p1, p2):
     lat1, lon1 = math.radians(p1[0]), math.radians(p1[1])
@@ -26,3 +27,47 @@ def speed_to_color(speed_mps):
     if kmh < 30:  return "#ffff00"
     if kmh < 50:  return "#ff8800"
     return "#ff0000"
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Returns indices of n_out points that keep the visual shape of (x, y).
+    Bucket averages are computed in one shot; the per-bucket pick is a numpy op.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 buckets over the inner points; first and last are always kept
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a])
+                      - (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+TILE_SIZE = 256
+
+def latlon_to_pixels(lat, lon, zoom):
+    """Web Mercator global pixel coordinates at zoom (vectorized)"""
+    lat = np.clip(np.asarray(lat, dtype=float), -85.05112878, 85.05112878)
+    lon = np.asarray(lon, dtype=float)
+    scale = TILE_SIZE * 2 ** zoom
+    s = np.sin(np.radians(lat))
+    x = (lon + 180) / 360 * scale
+    y = (0.5 - np.log((1 + s) / (1 - s)) / (4 * np.pi)) * scale
+    return x, y